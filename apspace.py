@@ -1,15 +1,24 @@
 import aiohttp
 import aiohttp.web
 import asyncio
-from bs4 import BeautifulSoup
 import logging
 import os
-import arrow
+import re
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import multidict
+import orjson
+import yarl
 
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 API_KEY = os.environ['API_KEY']
+_TICKET_RE = re.compile(rb'action="https://cas\.apiit\.edu\.my/cas/v1/tickets/([^"]+)"')
+_KL = ZoneInfo('Asia/Kuala_Lumpur')
+
+__all__ = ["APSpace", "OTPError", "CredentialsInvalid"]
 
 
 class OTPError(Exception):
@@ -90,12 +99,57 @@ class APSpace:
             'Referer': 'https://apspace.apu.edu.my/',
             'Content-type': 'application/x-www-form-urlencoded'
         }
+        # Pre-converted once so aiohttp skips the dict -> CIMultiDict
+        # conversion on every request.
+        self._base_headers = multidict.CIMultiDict(self.headers)
         self.ticket = None
         self.intake = None
         self.current_semester = None
-        self.session = aiohttp.ClientSession(headers = self.headers)
+        self.session: aiohttp.ClientSession | None = None
+        self._ticket_cache: dict[str, tuple[str, float]] = {}
+        self._sub_and_course_cache: dict[str, list] = {}
+        self._courses_cache: list | None = None
+        self._timetable_etag: str | None = None
+        self._timetable_cache: list | None = None
+        self._attendix_headers: multidict.CIMultiDict | None = None
+        self._cas_sem = asyncio.Semaphore(8)
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """
+        Lazily creates the shared aiohttp session with a tuned connector.
+
+        Creating the session here instead of __init__ avoids needing a
+        running event loop at construction time and lets every request
+        reuse the same keep-alived connection pool.
+
+        Returns
+        ----------
+        self.session : Shared aiohttp.ClientSession instance
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit = 0,
+                limit_per_host = 16,
+                ttl_dns_cache = 300,
+                keepalive_timeout = 75,
+                enable_cleanup_closed = True
+            )
+            self.session = aiohttp.ClientSession(headers = self._base_headers, connector = connector)
+        return self.session
+
+    async def aclose(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        await self._ensure_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
 
     async def login(self, credentials: dict) -> str:
+        await self._ensure_session()
         payload = {
             'username': credentials['username'],
             'password': credentials['password']
@@ -103,8 +157,7 @@ class APSpace:
 
         ticket_html = await self.session.post(self.ticket_url, data = payload)
         if ticket_html.status == 201:
-            soup = BeautifulSoup(await ticket_html.text(), "lxml")
-            self.ticket = soup.find("form").get('action').replace('https://cas.apiit.edu.my/cas/v1/tickets/', '')
+            self.ticket = _TICKET_RE.search(await ticket_html.read()).group(1).decode()
             logger.info("Logged in to APSpace!")
             await self.load_details()
         else:
@@ -114,8 +167,15 @@ class APSpace:
             raise CredentialsInvalid(ticket_json['authentication_exceptions'][1][0])
 
     async def load_details(self):
-        self.intake = await self.get_intake_details("current_intake")
-        self.current_semester = await self.get_current_semester()
+        # The semester lookup needs the intake code, so the two flows cannot
+        # fully overlap; instead the CAS ticket for the semester endpoint is
+        # pre-warmed concurrently with the intake fetch, then the semester
+        # request itself reuses it from the ticket cache.
+        self.intake, _ = await asyncio.gather(
+            self.get_intake_details("current_intake"),
+            self.get_service_auth("student/sub_and_course_details")
+        )
+        self.current_semester = await self.get_current_semester(self.intake)
 
     async def take_attendance(self, otp: str) -> str:
         if (len(otp) != 3):
@@ -142,14 +202,14 @@ class APSpace:
             "query": "mutation updateAttendance($otp: String!) {updateAttendance(otp: $otp) {id   attendance    "
                      "classcode    date    startTime    endTime    classType    __typename  }}"
         }
-        headers = self.headers
-        headers.update({
-            'ticket': auth_ticket,
-            'x-amz-user-agent': 'aws-amplify/2.0.7',
-            'x-api-key': API_KEY
-        })
+        if self._attendix_headers is None:
+            self._attendix_headers = multidict.CIMultiDict(self._base_headers)
+            self._attendix_headers['x-amz-user-agent'] = 'aws-amplify/2.0.7'
+            self._attendix_headers['x-api-key'] = API_KEY
+        headers = multidict.CIMultiDict(self._attendix_headers)
+        headers['ticket'] = auth_ticket
         otp_response = await self.session.post("https://attendix.apu.edu.my/graphql", json = payload, headers = headers)
-        otp_json = await otp_response.json()
+        otp_json = await otp_response.json(loads = orjson.loads)
         if otp_response.status == 200:
             if (otp_json['data'] == "null" or not otp_json['data']):
                 logger.error(otp_json['errors'][0]['message'])
@@ -181,66 +241,87 @@ class APSpace:
         response = await self.session.get(attendance_url)
         if response.status == 200:
             logger.debug("Request for attendance percentage successful!")
-            total_attendance, count = 0, 0
-            for course in await response.json():
-                if (course['SEMESTER'] == self.current_semester):
-                    total_attendance += course['PERCENTAGE']
-                    count += 1
-            return round(total_attendance / count, 2)
+            attendance = await response.json(loads = orjson.loads)
+            percentages = [course['PERCENTAGE'] for course in attendance
+                           if (course['SEMESTER'] == self.current_semester)]
+            return round(sum(percentages) / len(percentages), 2)
         elif response.status == 401:
             logger.error("APSpace Auth Ticket is invalid!")
             raise aiohttp.web.HTTPUnauthorized(reason = "Unauthorised", text = "APSpace Auth Ticket is invalid!")
 
-    async def get_semester_details(self, intake_code=None):
+    async def _fetch_sub_and_course(self, intake_code=None):
+        """
+        Fetches sub_and_course_details for an intake, caching the parsed JSON.
+
+        Both get_semester_details and get_current_semester need the same
+        payload, so the parsed list is memoized per intake for the lifetime
+        of this APSpace instance.
+
+        Parameters
+        ----------
+        intake_code : str, optional
+            Intake to query; defaults to the logged-in student's intake.
+
+        Returns
+        ----------
+        sub_and_course_details : Parsed list of semester/course dicts
+        """
+        intake = self.intake if intake_code is None else intake_code
+        cached = self._sub_and_course_cache.get(intake)
+        if cached is not None:
+            return cached
         auth_ticket = await self.get_service_auth("student/sub_and_course_details")
         query = {
-            'intake': self.intake if intake_code is None else intake_code,
+            'intake': intake,
             'ticket': auth_ticket
         }
         sub_and_course_url = self.apiit_url_builder(service_name = "sub_and_course_details", query = query)
         response = await self.session.get(sub_and_course_url)
         if response.status == 200:
-            logger.debug("Request for semester details sucessful!")
-            sub_and_course_details = await response.json()
-            temp = len(sub_and_course_details)
-            match temp:
-                case 1:
-                    self.current_semester = 1
-                    prev_intake_code = await self.get_intake_details("previous_intake")
-                    if prev_intake_code:
-                        return await self.get_semester_details(prev_intake_code)
-                    else:
-                        cgpa = 0.00
-                case 2:
-                    self.current_semester = 2
-                    cgpa = sub_and_course_details[-2]['IMMIGRATION_GPA']
-            return self.current_semester, cgpa
+            logger.debug("Request for sub and course details sucessful!")
+            sub_and_course_details = await response.json(loads = orjson.loads)
+            self._sub_and_course_cache[intake] = sub_and_course_details
+            return sub_and_course_details
         elif response.status == 401:
             logger.error("APSpace Auth Ticket is invalid!")
             raise aiohttp.web.HTTPUnauthorized(reason = "Unauthorised", text = "APSpace Auth Ticket is invalid!")
 
+    async def get_semester_details(self, intake_code=None):
+        intake = self.intake if intake_code is None else intake_code
+        intakes = [intake]
+        prev_intake_code = await self.get_intake_details("previous_intake")
+        if prev_intake_code and prev_intake_code != intake:
+            intakes.append(prev_intake_code)
+        for code in intakes:
+            sub_and_course_details = await self._fetch_sub_and_course(code)
+            if len(sub_and_course_details) == 2:
+                self.current_semester = 2
+                return self.current_semester, sub_and_course_details[-2]['IMMIGRATION_GPA']
+        self.current_semester = 1
+        return self.current_semester, 0.00
+
     async def get_current_semester(self, intake_code=None):
-        auth_ticket = await self.get_service_auth("student/sub_and_course_details")
-        query = {
-            'intake': self.intake if intake_code is None else intake_code,
-            'ticket': auth_ticket
-        }
-        sub_and_course_url = self.apiit_url_builder(service_name = "sub_and_course_details", query = query)
-        response = await self.session.get(sub_and_course_url)
-        if response.status == 200:
-            logger.debug("Request for semester number sucessful!")
-            temp = len(await response.json())
-            match temp:
-                case 1:
-                    current_semester = 1
-                case 2:
-                    current_semester = 2
-            return current_semester
-        elif response.status == 401:
-            logger.error("APSpace Auth Ticket is invalid!")
-            raise aiohttp.web.HTTPUnauthorized(reason = "Unauthorised", text = "APSpace Auth Ticket is invalid!")
+        sub_and_course_details = await self._fetch_sub_and_course(intake_code)
+        match len(sub_and_course_details):
+            case 1:
+                current_semester = 1
+            case 2:
+                current_semester = 2
+        return current_semester
+
+    async def _fetch_courses(self):
+        """
+        Fetches the student's courses list, caching the parsed JSON.
 
-    async def get_intake_details(self, query_type):
+        The courses payload feeds every get_intake_details query_type, so
+        it is fetched once and reused for the lifetime of this instance.
+
+        Returns
+        ----------
+        self._courses_cache : Parsed list of course dicts
+        """
+        if self._courses_cache is not None:
+            return self._courses_cache
         auth_ticket = await self.get_service_auth("student/courses")
         query = {
             'ticket': auth_ticket
@@ -249,26 +330,31 @@ class APSpace:
         response = await self.session.get(courses_url)
         if response.status == 200:
             logger.debug("Request for courses details successful!")
-            response = await response.json()
-            match query_type:
-                case "previous_intake":
-                    if len(response) > 1:
-                        return response[-1]['INTAKE_CODE']
-                    else:
-                        return None
-                case "current_intake":
-                    return response[0]['INTAKE_CODE']
-                case "course_name":
-                    return response[0]['COURSE_DESCRIPTION']
-                case "course_type":
-                    return response[0]['TYPE_OF_COURSE']
-                case "all_current":
-                    return response[0]['INTAKE_CODE'], response[0]['COURSE_DESCRIPTION'], \
-                           response[0]['TYPE_OF_COURSE']
+            self._courses_cache = await response.json(loads = orjson.loads)
+            return self._courses_cache
         elif response.status == 401:
             logger.error("APSpace Auth Ticket is invalid!")
+            self._courses_cache = None
             raise aiohttp.web.HTTPUnauthorized(reason = "Unauthorised", text = "APSpace Auth Ticket is invalid!")
 
+    async def get_intake_details(self, query_type):
+        courses = await self._fetch_courses()
+        match query_type:
+            case "previous_intake":
+                if len(courses) > 1:
+                    return courses[-1]['INTAKE_CODE']
+                else:
+                    return None
+            case "current_intake":
+                return courses[0]['INTAKE_CODE']
+            case "course_name":
+                return courses[0]['COURSE_DESCRIPTION']
+            case "course_type":
+                return courses[0]['TYPE_OF_COURSE']
+            case "all_current":
+                return courses[0]['INTAKE_CODE'], courses[0]['COURSE_DESCRIPTION'], \
+                       courses[0]['TYPE_OF_COURSE']
+
     async def get_my_modules(self):
         auth_ticket = await self.get_service_auth("student/attendance")
         query = {
@@ -279,40 +365,78 @@ class APSpace:
         response = await self.session.get(attendance_url)
         if response.status == 200:
             logger.debug("Request for semester modules successful!")
-            modules = [course['MODULE_ATTENDANCE'] for course in await response.json()
+            modules = [course['MODULE_ATTENDANCE'] for course in await response.json(loads = orjson.loads)
                        if (course['SEMESTER'] == self.current_semester)]
             return modules
         elif response.status == 401:
             logger.error("APSpace Auth Ticket is invalid!")
             raise aiohttp.web.HTTPUnauthorized(reason = "Unauthorised", text = "APSpace Auth Ticket is invalid!")
 
+    async def refresh_dashboard(self):
+        """
+        Fetches attendance percentage, semester modules and semester details
+        concurrently for a dashboard-style refresh.
+
+        The CAS tickets for the three endpoints are pre-warmed into the
+        ticket cache first so the gathered requests do not serialize on CAS.
+
+        Returns
+        ----------
+        attendance, modules, semester_info : Results of the three fetches
+        """
+        await asyncio.gather(
+            self.get_service_auth("student/attendance"),
+            self.get_service_auth("student/sub_and_course_details"),
+            self.get_service_auth("student/courses")
+        )
+        attendance, modules, semester_info = await asyncio.gather(
+            self.get_attendance_percentage(),
+            self.get_my_modules(),
+            self.get_semester_details()
+        )
+        return attendance, modules, semester_info
+
     async def get_weekly_timetable(self):
         timetable_url = "https://s3-ap-southeast-1.amazonaws.com/open-ws/weektimetable"
-        response = await self.session.get(timetable_url)
-        if response.status_code == 200:
-            response = await response.json()
-            semester_modules = await self.get_my_modules()
-            semester_modules = [name.title() for name in semester_modules]
-            for schedule in response:
-                if (schedule['MODULE_NAME'].replace('&', 'And').title() in semester_modules and
-                        schedule['INTAKE'] == self.intake and
-                        arrow.get(schedule['TIME_FROM_ISO']) > arrow.now('Asia/Kuala_Lumpur')):
-                    yield schedule
+        headers = {}
+        if self._timetable_etag is not None:
+            headers['If-None-Match'] = self._timetable_etag
+        response = await self.session.get(timetable_url, headers = headers)
+        if response.status == 304:
+            logger.debug("Weekly timetable unchanged, reusing cached copy!")
+            response = self._timetable_cache
+        elif response.status == 200:
+            self._timetable_etag = response.headers.get('ETag')
+            response = await response.json(loads = orjson.loads)
+            self._timetable_cache = response
         else:
             logger.critical("Something went wrong when requesting for weekly timetable!")
+            return
+        semester_modules = frozenset(name.title() for name in await self.get_my_modules())
+        now = datetime.now(_KL)
+        for schedule in response:
+            if (schedule['INTAKE'] == self.intake and
+                    schedule['MODULE_NAME'].replace('&', 'And').title() in semester_modules and
+                    datetime.fromisoformat(schedule['TIME_FROM_ISO']) > now):
+                yield schedule
 
     def apiit_url_builder(self, service_name, query):
-        query_string = []
-        for key in query.keys():
-            query_string.append(
-                f'{key}={query[key]}'
-            )
-        return f'{self.apiit_url}{service_name}?{"&".join(query_string)}'
+        # yarl percent-encodes the query values (CAS tickets can contain
+        # reserved characters) and aiohttp accepts the URL object directly
+        # without re-parsing it.
+        return yarl.URL(f'{self.apiit_url}{service_name}').with_query(query)
+
+    # TTL (seconds) for reusing service tickets per service. The attendix
+    # ticket is consumed by the attendance mutation, so it is never cached.
+    SERVICE_TICKET_TTL = 60
 
     async def get_service_auth(self, service_name: str) -> str:
         """
         Gets ticket (API authentication) from API according to the service_name provided (attendix OR student/attendance).
 
+        Tickets for the read-only student endpoints are cached for a short
+        TTL so back-to-back calls skip the CAS round trip.
+
         Parameters
         ----------
         service_name : int
@@ -321,21 +445,33 @@ class APSpace:
         ----------
         service_ticket : Authentication string to API
         """
+        cached = self._ticket_cache.get(service_name)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
         service_ticket_url = f'{self.ticket_url}/{self.ticket}?service=https://api.apiit.edu.my/{service_name}'
-        response = await self.session.post(service_ticket_url, data = "")
+        async with self._cas_sem:
+            for attempt in range(3):
+                try:
+                    response = await self.session.post(service_ticket_url, data = "")
+                    break
+                except aiohttp.ClientConnectorError:
+                    if attempt == 2:
+                        raise
+                    logger.warning("CAS ticket request failed to connect, retrying...")
+                    await asyncio.sleep(0.2 * 2 ** attempt)
         service_ticket = await response.text()
+        if service_name != "attendix":
+            self._ticket_cache[service_name] = (service_ticket, time.monotonic() + self.SERVICE_TICKET_TTL)
         return service_ticket
 
 
 async def main():
-    apspace_session = APSpace()
-    await apspace_session.login('credentials')
-    try:
-        print(await apspace_session.get_semester_details())
-    except OTPError as e:
-        print(e.message)
-    finally:
-        await apspace_session.session.close()
+    async with APSpace() as apspace_session:
+        await apspace_session.login('credentials')
+        try:
+            print(await apspace_session.get_semester_details())
+        except OTPError as e:
+            print(e.message)
 
 
 if __name__ == "__main__":